@@ -1,14 +1,32 @@
 from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 from typing import List, Dict, Any, Optional
+import asyncio
+import numpy as np
 import os
 import logging
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 from dotenv import load_dotenv
 
 # Load environment variables
 load_dotenv()
 
+# Shared server sizing: uvicorn cannot combine reload with workers, so debug
+# runs single-worker; production defaults to 4
+DEBUG = os.getenv("DEBUG", "true").lower() == "true"
+WORKERS = 1 if DEBUG else max(1, int(os.getenv("WORKERS", "4")))
+
+# BLAS thread counts are read when torch is imported (which happens in
+# startup_event via the embedder), so pin them here. Default splits the CPUs
+# across the uvicorn workers so the workers don't oversubscribe each other.
+_default_threads = max(1, (os.cpu_count() or 4) // WORKERS)
+TORCH_THREADS = int(os.getenv("TORCH_THREADS", str(_default_threads)))
+os.environ.setdefault("OMP_NUM_THREADS", str(TORCH_THREADS))
+os.environ.setdefault("MKL_NUM_THREADS", str(TORCH_THREADS))
+
 # Configure logging
 logging.basicConfig(level=getattr(logging, os.getenv("LOG_LEVEL", "INFO")))
 logger = logging.getLogger(__name__)
@@ -38,6 +56,10 @@ class SearchRequest(BaseModel):
     query: str
     top_k: int = 5
 
+class SearchBatchRequest(BaseModel):
+    queries: List[str]
+    top_k: int = 5
+
 class AnswerRequest(BaseModel):
     question: str
     context: List[str]
@@ -51,6 +73,10 @@ class SearchResponse(BaseModel):
     results: List[Dict[str, Any]]
     query: str
 
+class SearchBatchResponse(BaseModel):
+    results: List[List[Dict[str, Any]]]
+    queries: List[str]
+
 class AnswerResponse(BaseModel):
     answer: str
     sources: List[str]
@@ -61,6 +87,10 @@ vector_store = None
 embedder = None
 llm_client = None
 
+# Executor for blocking embed/search work; PyTorch and FAISS release the GIL
+# for tensor ops, so running them here keeps the event loop responsive
+EMBED_EXECUTOR = ThreadPoolExecutor(max_workers=int(os.getenv("EMBED_WORKERS", "2")))
+
 @app.on_event("startup")
 async def startup_event():
     """Initialize components on startup"""
@@ -70,6 +100,17 @@ async def startup_event():
     
     # Initialize components (will be implemented in src/rag_basic/)
     try:
+        # Pin intra/inter-op thread pools before the embedder does any work;
+        # the default is often wrong (1 in containers, or oversubscribed)
+        import torch
+        torch.set_num_threads(TORCH_THREADS)
+        try:
+            torch.set_num_interop_threads(2)
+        except RuntimeError:
+            # Can only be set once, before any parallel work has run
+            pass
+        logger.info(f"torch threads pinned to {TORCH_THREADS}")
+
         from src.rag_basic.embedder import SentenceTransformerEmbedder
         from src.rag_basic.faiss_store import FAISSVectorStore
         from src.rag_basic.llm_client import LLMClient
@@ -98,6 +139,13 @@ async def startup_event():
         logger.error(f"Failed to initialize RAG components: {e}")
         raise
 
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Flush pending vector store writes on shutdown"""
+    if vector_store is not None:
+        vector_store.flush()
+        logger.info("Flushed vector store on shutdown")
+
 @app.get("/")
 async def root():
     """Health check endpoint"""
@@ -114,12 +162,19 @@ async def embed_documents(request: EmbedRequest):
         if not vector_store or not embedder:
             raise HTTPException(status_code=500, detail="Vector store not initialized")
         
-        # Generate embeddings
-        embeddings = embedder.embed_texts(request.texts)
-        
+        loop = asyncio.get_running_loop()
+
+        # Generate embeddings off the event loop
+        embeddings = await loop.run_in_executor(
+            EMBED_EXECUTOR, embedder.embed_texts, request.texts
+        )
+
         # Store in vector database
         metadata = request.metadata or [{"source": f"doc_{i}"} for i in range(len(request.texts))]
-        vector_store.add_documents(request.texts, embeddings, metadata)
+        await loop.run_in_executor(
+            EMBED_EXECUTOR,
+            partial(vector_store.add_documents, request.texts, embeddings, metadata)
+        )
         
         logger.info(f"Embedded {len(request.texts)} documents")
         
@@ -139,11 +194,18 @@ async def search_documents(request: SearchRequest):
         if not vector_store or not embedder:
             raise HTTPException(status_code=500, detail="Vector store not initialized")
         
-        # Embed the query
-        query_embedding = embedder.embed_texts([request.query])[0]
-        
+        loop = asyncio.get_running_loop()
+
+        # Embed the query off the event loop
+        query_embeddings = await loop.run_in_executor(
+            EMBED_EXECUTOR, embedder.embed_texts, [request.query]
+        )
+
         # Search for similar documents
-        results = vector_store.search(query_embedding, k=request.top_k)
+        results = await loop.run_in_executor(
+            EMBED_EXECUTOR,
+            partial(vector_store.search, query_embeddings[0], k=request.top_k)
+        )
         
         logger.info(f"Search completed for query: {request.query}")
         
@@ -156,6 +218,51 @@ async def search_documents(request: SearchRequest):
         logger.error(f"Error searching documents: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/search_batch", response_model=SearchBatchResponse)
+async def search_documents_batch(request: SearchBatchRequest):
+    """Search for relevant documents for multiple queries in one call"""
+    try:
+        if not vector_store or not embedder:
+            raise HTTPException(status_code=500, detail="Vector store not initialized")
+
+        loop = asyncio.get_running_loop()
+
+        # Embed all queries in one batch off the event loop
+        query_embeddings = await loop.run_in_executor(
+            EMBED_EXECUTOR, embedder.embed_texts, request.queries
+        )
+
+        # One FAISS call for the whole batch
+        results = await loop.run_in_executor(
+            EMBED_EXECUTOR,
+            partial(vector_store.search_batch, np.asarray(query_embeddings), k=request.top_k)
+        )
+
+        logger.info(f"Batch search completed for {len(request.queries)} queries")
+
+        return SearchBatchResponse(
+            results=results,
+            queries=request.queries
+        )
+
+    except Exception as e:
+        logger.error(f"Error in batch search: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+# Static instruction preamble, kept byte-identical across requests so the
+# provider can reuse its KV/prefix cache for these tokens
+SYSTEM_PROMPT = "Based on the provided context, answer the question. If the context doesn't contain enough information to answer the question, say so."
+
+def build_rag_prompt(question: str, context: List[str]) -> str:
+    """Build the variable part of the RAG prompt (context + question)"""
+    joined_context = "\n\n".join(context)
+    return f"""Context:
+{joined_context}
+
+Question: {question}
+
+Answer:"""
+
 @app.post("/answer", response_model=AnswerResponse)
 async def generate_answer(request: AnswerRequest):
     """Generate an answer using RAG"""
@@ -163,20 +270,9 @@ async def generate_answer(request: AnswerRequest):
         if not llm_client:
             raise HTTPException(status_code=500, detail="LLM client not initialized")
         
-        # Create context from retrieved documents
-        context = "\n\n".join(request.context)
-        
         # Generate answer using LLM
-        prompt = f"""Based on the following context, answer the question. If the context doesn't contain enough information to answer the question, say so.
-
-Context:
-{context}
-
-Question: {request.question}
-
-Answer:"""
-        
-        answer = await llm_client.generate(prompt)
+        prompt = build_rag_prompt(request.question, request.context)
+        answer = await llm_client.generate(prompt, system=SYSTEM_PROMPT)
         
         # Extract sources from search results metadata
         sources = []
@@ -201,6 +297,35 @@ Answer:"""
         logger.error(f"Error generating answer: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+def format_sse_event(data: str) -> str:
+    """Format a payload as a server-sent event
+
+    Each line gets its own ``data:`` prefix; a bare newline inside the
+    payload would otherwise terminate the event early and corrupt the
+    stream for compliant EventSource clients.
+    """
+    return "".join(f"data: {line}\n" for line in data.split("\n")) + "\n"
+
+@app.post("/answer/stream")
+async def generate_answer_stream(request: AnswerRequest):
+    """Generate an answer using RAG, streamed as server-sent events"""
+    if not llm_client:
+        raise HTTPException(status_code=500, detail="LLM client not initialized")
+
+    prompt = build_rag_prompt(request.question, request.context)
+
+    async def event_stream():
+        try:
+            async for chunk in llm_client.generate_stream(prompt, system=SYSTEM_PROMPT):
+                yield format_sse_event(chunk)
+            yield format_sse_event("[DONE]")
+        except Exception as e:
+            logger.error(f"Error streaming answer: {e}")
+            yield "event: error\ndata: answer generation failed\n\n"
+
+    logger.info(f"Streaming answer for question: {request.question}")
+    return StreamingResponse(event_stream(), media_type="text/event-stream")
+
 @app.get("/health")
 async def health_check():
     """Detailed health check"""
@@ -215,9 +340,15 @@ async def health_check():
 
 if __name__ == "__main__":
     import uvicorn
+
     uvicorn.run(
         "main:app",
         host=os.getenv("API_HOST", "0.0.0.0"),
         port=int(os.getenv("API_PORT", "8000")),
-        reload=os.getenv("DEBUG", "true").lower() == "true"
+        reload=DEBUG,
+        # uvicorn[standard] extras: uvloop event loop + C HTTP parser
+        loop="uvloop",
+        http="httptools",
+        workers=WORKERS,
+        proxy_headers=True
     )
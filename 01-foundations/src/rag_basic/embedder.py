@@ -1,79 +1,302 @@
 from sentence_transformers import SentenceTransformer
 import numpy as np
+import hashlib
+import os
+import threading
+from collections import OrderedDict
 from typing import List
 import logging
 
+try:
+    import onnxruntime
+except ImportError:
+    onnxruntime = None
+
 logger = logging.getLogger(__name__)
 
 class SentenceTransformerEmbedder:
     """Wrapper for SentenceTransformer models"""
-    
-    def __init__(self, model_name: str = "sentence-transformers/all-MiniLM-L6-v2"):
+
+    def __init__(self, model_name: str = "sentence-transformers/all-MiniLM-L6-v2",
+                 use_onnx: bool = True, batch_size: int = 32):
         """
         Initialize the embedder with a specific model
-        
+
         Args:
             model_name: Name of the sentence transformer model to use
+            use_onnx: Export the transformer to ONNX and serve it with
+                ONNX Runtime when available (falls back to PyTorch otherwise)
+            batch_size: Mini-batch size used for length-bucketed encoding
         """
         self.model_name = model_name
+        self.batch_size = batch_size
+        self._cache: "OrderedDict[bytes, np.ndarray]" = OrderedDict()
+        self._cache_size = int(os.getenv("EMBED_CACHE_SIZE", "100000"))
+        # embed_texts runs on a thread pool, so cache hit/insert/evict
+        # paths need a lock (encoding itself happens outside it)
+        self._cache_lock = threading.Lock()
+        self.ort_session = None
+        self.tokenizer = None
         logger.info(f"Loading sentence transformer model: {model_name}")
-        
+
         try:
             self.model = SentenceTransformer(model_name)
             logger.info(f"Successfully loaded model: {model_name}")
         except Exception as e:
             logger.error(f"Failed to load model {model_name}: {e}")
             raise
-    
-    def embed_texts(self, texts: List[str]) -> List[np.ndarray]:
+
+        # Place the model explicitly rather than trusting the default device
+        import torch
+        self.device = "cuda" if torch.cuda.is_available() else "cpu"
+        self.model = self.model.to(self.device)
+        logger.info(f"Embedder running on {self.device}")
+
+        # INT8 dynamic quantization is a CPU-only optimization
+        self.quantize = os.getenv("QUANTIZE", "0") == "1" and self.device == "cpu"
+
+        if use_onnx and onnxruntime is not None:
+            try:
+                self._initialize_onnx()
+                logger.info(f"Serving {model_name} with ONNX Runtime")
+            except Exception as e:
+                logger.warning(f"ONNX initialization failed, falling back to PyTorch: {e}")
+                self.ort_session = None
+
+        if self.quantize and self.ort_session is None:
+            # ONNX path quantizes the exported graph instead
+            self._quantize_model()
+
+        if self.ort_session is None and not self.quantize:
+            # Fuse the eager PyTorch path; quantized modules don't compile
+            self._compile_model()
+
+    def _quantize_model(self):
+        """Apply INT8 dynamic quantization to the transformer's Linear layers"""
+        import torch
+
+        try:
+            self.model = torch.ao.quantization.quantize_dynamic(
+                self.model, {torch.nn.Linear}, dtype=torch.qint8
+            )
+            logger.info("Applied INT8 dynamic quantization to Linear layers")
+        except Exception as e:
+            logger.warning(f"Dynamic quantization failed, keeping FP32 model: {e}")
+            self.quantize = False
+
+    def _compile_model(self):
+        """Compile the transformer forward pass to cut per-op dispatch overhead
+
+        The compile has to target the underlying auto_model: wrapping the
+        whole SentenceTransformer is a no-op because encode() resolves to a
+        method bound to the original module, so the compiled graph would
+        never run.
+        """
+        import torch
+
+        if not hasattr(torch, "compile"):
+            return
+
+        eager_auto_model = self.model[0].auto_model
+        try:
+            self.model[0].auto_model = torch.compile(
+                eager_auto_model, mode="reduce-overhead", dynamic=True
+            )
+            # Warm the compile cache so the first request doesn't pay for it
+            self.model.encode(["warmup"], convert_to_numpy=True)
+            logger.info("Compiled transformer forward pass with torch.compile")
+        except Exception as e:
+            logger.warning(f"torch.compile failed, using eager mode: {e}")
+            self.model[0].auto_model = eager_auto_model
+
+    def _initialize_onnx(self):
+        """Export the transformer to ONNX and create an ONNX Runtime session"""
+        import torch
+
+        onnx_dir = os.getenv("ONNX_CACHE_DIR", "./data/onnx")
+        os.makedirs(onnx_dir, exist_ok=True)
+        onnx_path = os.path.join(onnx_dir, self.model_name.replace("/", "_") + ".onnx")
+
+        self.tokenizer = self.model.tokenizer
+
+        if not os.path.exists(onnx_path):
+            # Export the underlying transformer with dynamic batch/sequence axes
+            auto_model = self.model[0].auto_model
+            auto_model.eval()
+            # Dummy inputs must live on the model's device (the model may
+            # already have been moved to CUDA) or the export fails
+            model_device = next(auto_model.parameters()).device
+            dummy_ids = torch.ones((1, 8), dtype=torch.long, device=model_device)
+            dummy_mask = torch.ones((1, 8), dtype=torch.long, device=model_device)
+            torch.onnx.export(
+                auto_model,
+                (dummy_ids, dummy_mask),
+                onnx_path,
+                input_names=["input_ids", "attention_mask"],
+                output_names=["last_hidden_state"],
+                dynamic_axes={
+                    "input_ids": {0: "batch", 1: "sequence"},
+                    "attention_mask": {0: "batch", 1: "sequence"},
+                    "last_hidden_state": {0: "batch", 1: "sequence"}
+                },
+                opset_version=17
+            )
+            logger.info(f"Exported ONNX model to {onnx_path}")
+
+        if self.quantize:
+            # Quantize the ONNX graph instead; ORT's integer matmul kernels
+            # dispatch VNNI on supporting CPUs
+            from onnxruntime.quantization import quantize_dynamic, QuantType
+
+            quantized_path = onnx_path.replace(".onnx", ".int8.onnx")
+            if not os.path.exists(quantized_path):
+                quantize_dynamic(onnx_path, quantized_path, weight_type=QuantType.QInt8)
+                logger.info(f"Quantized ONNX model to {quantized_path}")
+            onnx_path = quantized_path
+
+        sess_options = onnxruntime.SessionOptions()
+        sess_options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        sess_options.intra_op_num_threads = os.cpu_count() or 4
+
+        self.ort_session = onnxruntime.InferenceSession(
+            onnx_path,
+            sess_options=sess_options,
+            providers=["CUDAExecutionProvider", "CPUExecutionProvider"]
+        )
+
+    def _encode_onnx(self, texts: List[str]) -> np.ndarray:
+        """Encode texts through the ONNX Runtime session"""
+        encoded = self.tokenizer(
+            texts, padding=True, truncation=True, return_tensors="np"
+        )
+        input_names = {inp.name for inp in self.ort_session.get_inputs()}
+        feed = {
+            name: encoded[name].astype(np.int64)
+            for name in ("input_ids", "attention_mask")
+            if name in input_names
+        }
+
+        last_hidden_state = self.ort_session.run(None, feed)[0]
+
+        # Mean pooling over non-padding tokens, then L2 normalization
+        mask = encoded["attention_mask"][..., np.newaxis].astype(np.float32)
+        summed = (last_hidden_state * mask).sum(axis=1)
+        counts = np.clip(mask.sum(axis=1), 1e-9, None)
+        embeddings = summed / counts
+        norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+        embeddings = embeddings / np.clip(norms, 1e-12, None)
+
+        return embeddings.astype(np.float32)
+
+    def _encode(self, texts: List[str]) -> np.ndarray:
+        """Encode one mini-batch through the active backend"""
+        if self.ort_session is not None:
+            return self._encode_onnx(texts)
+
+        if self.device == "cuda":
+            # BF16 autocast halves memory traffic per forward pass;
+            # encode casts the result back to float32
+            import torch
+            with torch.inference_mode(), \
+                    torch.autocast(device_type="cuda", dtype=torch.bfloat16):
+                return self.model.encode(texts, convert_to_numpy=True,
+                                         device=self.device, batch_size=len(texts))
+
+        return self.model.encode(texts, convert_to_numpy=True, batch_size=len(texts))
+
+    def _encode_bucketed(self, texts: List[str]) -> np.ndarray:
+        """
+        Encode texts in length-sorted mini-batches
+
+        Sorting by token length before batching means each mini-batch is
+        padded only to its local maximum, avoiding wasted compute on
+        padding tokens. Results are scattered back into input order.
+        """
+        if len(texts) <= self.batch_size:
+            return self._encode(texts)
+
+        tokenizer = self.tokenizer or self.model.tokenizer
+        lengths = [len(ids) for ids in tokenizer(texts, truncation=True)["input_ids"]]
+        order = np.argsort(lengths)
+
+        embeddings = None
+        for start in range(0, len(order), self.batch_size):
+            group = order[start:start + self.batch_size]
+            batch_embeddings = self._encode([texts[i] for i in group])
+            if embeddings is None:
+                embeddings = np.empty((len(texts), batch_embeddings.shape[1]),
+                                      dtype=np.float32)
+            embeddings[group] = batch_embeddings
+
+        return embeddings
+
+    def embed_texts(self, texts: List[str]) -> np.ndarray:
         """
         Generate embeddings for a list of texts
-        
+
         Args:
             texts: List of text strings to embed
-            
+
         Returns:
-            List of numpy arrays representing the embeddings
+            Float32 array of embeddings, shape (len(texts), dimension)
         """
         if not texts:
-            return []
-        
+            return np.empty((0, 0), dtype=np.float32)
+
         try:
-            embeddings = self.model.encode(texts, convert_to_numpy=True)
-            
-            # Convert to list of numpy arrays if needed
-            if isinstance(embeddings, np.ndarray):
-                if len(embeddings.shape) == 1:
-                    # Single embedding
-                    embeddings = [embeddings]
-                else:
-                    # Multiple embeddings
-                    embeddings = list(embeddings)
-            
+            keys = [hashlib.blake2b(t.encode(), digest_size=16).digest() for t in texts]
+
+            # Serve cached embeddings and encode only the misses
+            resolved = {}
+            miss_positions = []
+            with self._cache_lock:
+                for i, key in enumerate(keys):
+                    if key in self._cache:
+                        self._cache.move_to_end(key)
+                        resolved[key] = self._cache[key]
+                    elif key not in resolved:
+                        resolved[key] = None
+                        miss_positions.append(i)
+
+            if miss_positions:
+                # Outside the lock: concurrent misses for the same text may
+                # encode twice, but both insert the same value
+                miss_embeddings = self._encode_bucketed([texts[i] for i in miss_positions])
+                with self._cache_lock:
+                    for position, embedding in zip(miss_positions, miss_embeddings):
+                        resolved[keys[position]] = embedding
+                        self._cache[keys[position]] = embedding
+                        if len(self._cache) > self._cache_size:
+                            self._cache.popitem(last=False)
+
+            # Keep the (N, d) array contiguous; downstream FAISS code adds it
+            # directly without restacking
+            embeddings = np.stack([resolved[key] for key in keys])
+
             logger.info(f"Generated embeddings for {len(texts)} texts")
-            return embeddings
-            
+            return embeddings.astype(np.float32, copy=False)
+
         except Exception as e:
             logger.error(f"Error generating embeddings: {e}")
             raise
-    
+
     def embed_single_text(self, text: str) -> np.ndarray:
         """
         Generate embedding for a single text
-        
+
         Args:
             text: Text string to embed
-            
+
         Returns:
             Numpy array representing the embedding
         """
         embeddings = self.embed_texts([text])
-        return embeddings[0] if embeddings else np.array([])
-    
+        return embeddings[0] if len(embeddings) else np.array([])
+
     def get_embedding_dimension(self) -> int:
         """
         Get the dimension of the embeddings
-        
+
         Returns:
             Dimension of the embedding vectors
         """
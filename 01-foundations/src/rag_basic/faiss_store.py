@@ -1,12 +1,85 @@
 import faiss
 import numpy as np
+import json
 import pickle
 import os
+import threading
 from typing import List, Dict, Any, Optional
 import logging
 
+try:
+    import pyarrow as pa
+except ImportError:
+    pa = None
+
 logger = logging.getLogger(__name__)
 
+try:
+    import numba
+
+    @numba.njit(parallel=True, fastmath=True, cache=True)
+    def _normalize_rows(arr):
+        """L2-normalize rows of a float32 array in place"""
+        for i in numba.prange(arr.shape[0]):
+            n = 0.0
+            for j in range(arr.shape[1]):
+                n += arr[i, j] * arr[i, j]
+            if n > 0.0:
+                inv = 1.0 / np.sqrt(n)
+                for j in range(arr.shape[1]):
+                    arr[i, j] *= inv
+        return arr
+
+    @numba.njit(fastmath=True, cache=True)
+    def _mmr_order(query, candidates, lambda_):
+        """Greedy maximal-marginal-relevance ordering of candidate rows"""
+        n = candidates.shape[0]
+        sim_query = candidates @ query
+        sim_candidates = candidates @ candidates.T
+        order = np.empty(n, np.int64)
+        selected = np.zeros(n, np.bool_)
+        for pos in range(n):
+            best = -1
+            best_score = -1e30
+            for i in range(n):
+                if selected[i]:
+                    continue
+                diversity = 0.0
+                for j in range(pos):
+                    s = sim_candidates[i, order[j]]
+                    if s > diversity:
+                        diversity = s
+                score = lambda_ * sim_query[i] - (1.0 - lambda_) * diversity
+                if score > best_score:
+                    best_score = score
+                    best = i
+            order[pos] = best
+            selected[best] = True
+        return order
+
+except ImportError:
+    def _normalize_rows(arr):
+        """L2-normalize rows of a float32 array in place (NumPy fallback)"""
+        norms = np.linalg.norm(arr, axis=1, keepdims=True)
+        np.divide(arr, norms, out=arr, where=norms > 0)
+        return arr
+
+    def _mmr_order(query, candidates, lambda_):
+        """Greedy maximal-marginal-relevance ordering (NumPy fallback)"""
+        n = candidates.shape[0]
+        sim_query = candidates @ query
+        sim_candidates = candidates @ candidates.T
+        order = np.empty(n, np.int64)
+        selected = np.zeros(n, np.bool_)
+        for pos in range(n):
+            scores = lambda_ * sim_query
+            if pos > 0:
+                scores -= (1.0 - lambda_) * sim_candidates[:, order[:pos]].max(axis=1)
+            scores[selected] = -np.inf
+            order[pos] = np.argmax(scores)
+            selected[order[pos]] = True
+        return order
+
 class FAISSVectorStore:
     """FAISS-based vector store for document embeddings"""
     
@@ -22,6 +95,37 @@ class FAISSVectorStore:
         self.dimension = dimension
         self.documents: List[str] = []
         self.metadata: List[Dict[str, Any]] = []
+
+        # Semantic query cache: recent query embeddings with their results
+        self.query_cache_index = faiss.IndexFlatIP(dimension)
+        self.cached_results: List[List[Dict[str, Any]]] = []
+        self.query_cache_threshold = float(os.getenv("QUERY_CACHE_THRESHOLD", "0.95"))
+        self.query_cache_size = int(os.getenv("QUERY_CACHE_SIZE", "10000"))
+
+        # HNSW search-time/recall trade-off knob
+        self.ef_search = int(os.getenv("HNSW_EF_SEARCH", "64"))
+
+        # Write coalescing: persist every FLUSH_EVERY adds instead of every add
+        self.flush_every = int(os.getenv("FLUSH_EVERY", "1000"))
+        self._dirty = False
+        self._ops_since_flush = 0
+
+        # Read-only stores memory-map the index instead of loading it into RAM
+        self.read_only = os.getenv("READ_ONLY", "0") == "1"
+
+        # (embeddings, documents, metadata) blocks buffered until an IVF
+        # index has enough points to train on; kept together so documents
+        # are never persisted ahead of their vectors
+        self._pending_adds: List[tuple] = []
+
+        # GPU state for FP16 flat indexes (only with faiss-gpu + a device)
+        self._gpu_resources = None
+        self._on_gpu = False
+
+        # Serializes index mutation against searches: FAISS does not support
+        # concurrent add+search on one index, and the documents/metadata
+        # lists and query cache race when handlers run on a thread pool
+        self._lock = threading.RLock()
         
         # Create directory if it doesn't exist
         os.makedirs(os.path.dirname(index_path), exist_ok=True)
@@ -34,20 +138,49 @@ class FAISSVectorStore:
     def _initialize_index(self):
         """Initialize or load the FAISS index"""
         index_file = f"{self.index_path}.faiss"
-        metadata_file = f"{self.index_path}.pkl"
-        
-        if os.path.exists(index_file) and os.path.exists(metadata_file):
+        arrow_file = f"{self.index_path}.arrow"
+        pickle_file = f"{self.index_path}.pkl"
+
+        has_metadata = os.path.exists(arrow_file) or os.path.exists(pickle_file)
+        if os.path.exists(index_file) and has_metadata:
             # Load existing index
             try:
-                self.index = faiss.read_index(index_file)
-                
-                with open(metadata_file, 'rb') as f:
-                    data = pickle.load(f)
-                    self.documents = data.get('documents', [])
-                    self.metadata = data.get('metadata', [])
-                
+                if self.read_only:
+                    # Memory-map so the OS pages in only what searches touch,
+                    # instead of reading the whole index into RAM at startup
+                    self.index = faiss.read_index(
+                        index_file, faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY
+                    )
+                else:
+                    self.index = faiss.read_index(index_file)
+
+                if pa is not None and os.path.exists(arrow_file):
+                    # Zero-copy memory-mapped read of the Arrow IPC file
+                    with pa.memory_map(arrow_file) as source:
+                        table = pa.ipc.open_file(source).read_all()
+                    self.documents = table.column("document").to_pylist()
+                    self.metadata = [json.loads(m) for m in
+                                     table.column("metadata").to_pylist()]
+                else:
+                    # Legacy pickle metadata (or pyarrow not installed)
+                    with open(pickle_file, 'rb') as f:
+                        data = pickle.load(f)
+                        self.documents = data.get('documents', [])
+                        self.metadata = data.get('metadata', [])
+
+                # Move a loaded flat index to the GPU with FP16 storage
+                if (self._gpu_available() and not self.read_only
+                        and isinstance(self.index, faiss.IndexFlat)):
+                    self._gpu_resources = faiss.StandardGpuResources()
+                    cloner_options = faiss.GpuClonerOptions()
+                    cloner_options.useFloat16 = True
+                    self.index = faiss.index_cpu_to_gpu(
+                        self._gpu_resources, 0, self.index, cloner_options
+                    )
+                    self._on_gpu = True
+
                 logger.info(f"Loaded existing FAISS index with {len(self.documents)} documents")
-                
+
             except Exception as e:
                 logger.warning(f"Failed to load existing index: {e}. Creating new index.")
                 self._create_new_index()
@@ -55,129 +188,327 @@ class FAISSVectorStore:
             # Create new index
             self._create_new_index()
     
+    @staticmethod
+    def _gpu_available() -> bool:
+        """Whether a CUDA-enabled FAISS build and a GPU are present"""
+        return (hasattr(faiss, "GpuIndexFlatIP")
+                and getattr(faiss, "get_num_gpus", lambda: 0)() > 0)
+
     def _create_new_index(self):
-        """Create a new FAISS index"""
-        # Create a flat index for exact search
-        self.index = faiss.IndexFlatIP(self.dimension)  # Inner product for cosine similarity
+        """Create a new FAISS index (type selected via FAISS_INDEX_TYPE)"""
+        index_type = os.getenv("FAISS_INDEX_TYPE", "hnsw").lower()
+        self._on_gpu = False
+
+        if index_type == "ivfpq":
+            # Product quantization: each vector is stored as PQ_M 8-bit codes
+            # instead of dimension * 4 bytes, a ~32x memory reduction
+            nlist = int(os.getenv("IVF_NLIST", "256"))
+            pq_m = int(os.getenv("PQ_M", "48"))
+            quantizer = faiss.IndexFlatIP(self.dimension)
+            self.index = faiss.IndexIVFPQ(
+                quantizer, self.dimension, nlist, pq_m, 8, faiss.METRIC_INNER_PRODUCT
+            )
+            self.index.nprobe = int(os.getenv("IVF_NPROBE", "16"))
+        elif index_type == "flat":
+            if self._gpu_available():
+                # GPU-resident flat index with FP16 storage: halves the bytes
+                # read per query and searches from HBM bandwidth
+                self._gpu_resources = faiss.StandardGpuResources()
+                config = faiss.GpuIndexFlatConfig()
+                config.useFloat16 = True
+                self.index = faiss.GpuIndexFlatIP(
+                    self._gpu_resources, self.dimension, config
+                )
+                self._on_gpu = True
+            else:
+                # Brute-force exact search
+                self.index = faiss.IndexFlatIP(self.dimension)
+        else:
+            # HNSW graph index: visits O(log N) vectors per query instead of
+            # scanning the whole index like IndexFlatIP
+            self.index = faiss.IndexHNSWFlat(self.dimension, 32, faiss.METRIC_INNER_PRODUCT)
+            self.index.hnsw.efConstruction = int(os.getenv("HNSW_EF_CONSTRUCTION", "128"))
+            self.index.hnsw.efSearch = self.ef_search
+
         self.documents = []
         self.metadata = []
-        logger.info(f"Created new FAISS index with dimension {self.dimension}")
+        self._pending_adds = []
+        logger.info(f"Created new {index_type} index with dimension {self.dimension}")
     
-    def add_documents(self, documents: List[str], embeddings: List[np.ndarray], 
+    def add_documents(self, documents: List[str], embeddings: np.ndarray,
                      metadata: Optional[List[Dict[str, Any]]] = None):
         """
         Add documents and their embeddings to the vector store
-        
+
         Args:
             documents: List of document texts
-            embeddings: List of document embeddings
+            embeddings: Document embeddings, shape (N, dimension)
+                (a list of 1-D arrays is also accepted)
             metadata: Optional list of metadata for each document
         """
+        if self.read_only:
+            raise RuntimeError("Vector store was opened read-only (READ_ONLY=1)")
+
         if len(documents) != len(embeddings):
             raise ValueError("Number of documents must match number of embeddings")
         
         if metadata and len(metadata) != len(documents):
             raise ValueError("Number of metadata items must match number of documents")
         
-        # Normalize embeddings for cosine similarity
-        normalized_embeddings = []
-        for emb in embeddings:
-            norm = np.linalg.norm(emb)
-            if norm > 0:
-                normalized_emb = emb / norm
-            else:
-                normalized_emb = emb
-            normalized_embeddings.append(normalized_emb)
-        
-        # Convert to numpy array
-        embeddings_array = np.array(normalized_embeddings).astype('float32')
-        
-        # Add to FAISS index
-        self.index.add(embeddings_array)
-        
-        # Store documents and metadata
-        self.documents.extend(documents)
+        # Normalize embeddings for cosine similarity (JIT-compiled with numba
+        # when available). np.array copies, so the in-place normalization
+        # never mutates the caller's embeddings, and the result is the
+        # C-contiguous float32 buffer FAISS's SIMD kernels require.
+        embeddings_array = np.array(embeddings, dtype=np.float32)
+        _normalize_rows(embeddings_array)
+
         if metadata:
-            self.metadata.extend(metadata)
+            metadata_list = list(metadata)
         else:
-            self.metadata.extend([{"source": f"doc_{i}"} for i in range(len(documents))])
-        
-        # Save index and metadata
-        self._save_index()
-        
+            metadata_list = [{"source": f"doc_{i}"} for i in range(len(documents))]
+
+        with self._lock:
+            # Add to FAISS index; IVF indexes need training before they can
+            # add, so buffer until there are enough points for k-means. The
+            # documents and metadata are buffered with their vectors so a
+            # flush can never persist documents whose vectors were dropped,
+            # which would permanently offset index ids from self.documents.
+            if getattr(self.index, "is_trained", True):
+                self.index.add(embeddings_array)
+                self.documents.extend(documents)
+                self.metadata.extend(metadata_list)
+            else:
+                self._pending_adds.append(
+                    (embeddings_array, list(documents), metadata_list)
+                )
+                if sum(len(block[0]) for block in self._pending_adds) >= self.index.nlist:
+                    training_array = np.vstack([block[0] for block in self._pending_adds])
+                    self.index.train(training_array)
+                    self.index.add(training_array)
+                    for _, pending_documents, pending_metadata in self._pending_adds:
+                        self.documents.extend(pending_documents)
+                        self.metadata.extend(pending_metadata)
+                    self._pending_adds = []
+                    logger.info(f"Trained IVF index on {len(training_array)} vectors")
+
+            # Cached results are stale once the corpus changes
+            self._clear_query_cache()
+
+            # Coalesce writes: serializing the full index on every add is
+            # O(N^2) I/O over a bulk ingest
+            self._dirty = True
+            self._ops_since_flush += len(documents)
+            if self._ops_since_flush >= self.flush_every:
+                self.flush()
+
         logger.info(f"Added {len(documents)} documents to vector store")
     
-    def search(self, query_embedding: np.ndarray, k: int = 5) -> List[Dict[str, Any]]:
+    def search(self, query_embedding: np.ndarray, k: int = 5,
+               mmr_lambda: Optional[float] = None) -> List[Dict[str, Any]]:
         """
         Search for similar documents
-        
+
         Args:
             query_embedding: Query embedding vector
             k: Number of results to return
-            
+            mmr_lambda: Optional relevance/diversity trade-off in [0, 1];
+                when set, results are reranked with maximal marginal relevance
+
         Returns:
             List of dictionaries containing document text, metadata, and similarity score
         """
-        if self.index.ntotal == 0:
-            return []
-        
         # Normalize query embedding
         norm = np.linalg.norm(query_embedding)
         if norm > 0:
             normalized_query = query_embedding / norm
         else:
             normalized_query = query_embedding
-        
+
         # Convert to numpy array
         query_array = np.array([normalized_query]).astype('float32')
-        
-        # Search
-        scores, indices = self.index.search(query_array, min(k, self.index.ntotal))
-        
-        # Format results
-        results = []
-        for i, (score, idx) in enumerate(zip(scores[0], indices[0])):
-            if idx < len(self.documents):
-                results.append({
-                    "text": self.documents[idx],
-                    "metadata": self.metadata[idx],
-                    "score": float(score),
-                    "index": int(idx)
-                })
-        
-        logger.info(f"Search returned {len(results)} results")
-        return results
-    
+
+        with self._lock:
+            if self.index.ntotal == 0:
+                return []
+
+            # Return cached results if a semantically near-identical query was seen
+            cached = self._check_query_cache(query_array, k)
+            if cached is not None:
+                if mmr_lambda is not None and len(cached) > 1:
+                    cached = self._rerank_mmr(query_array, cached, mmr_lambda)
+                return cached
+
+            # Search; widen the HNSW beam for larger k so recall holds up
+            if hasattr(self.index, "hnsw"):
+                self.index.hnsw.efSearch = max(self.ef_search, 2 * k)
+            scores, indices = self.index.search(query_array, min(k, self.index.ntotal))
+
+            # Format results; FAISS pads short result lists with idx == -1
+            results = []
+            for i, (score, idx) in enumerate(zip(scores[0], indices[0])):
+                if 0 <= idx < len(self.documents):
+                    results.append({
+                        "text": self.documents[idx],
+                        "metadata": self.metadata[idx],
+                        "score": float(score),
+                        "index": int(idx)
+                    })
+
+            logger.info(f"Search returned {len(results)} results")
+            self._update_query_cache(query_array, results)
+
+            if mmr_lambda is not None and len(results) > 1:
+                results = self._rerank_mmr(query_array, results, mmr_lambda)
+            return results
+
+    def _rerank_mmr(self, query_array: np.ndarray, results: List[Dict[str, Any]],
+                    mmr_lambda: float) -> List[Dict[str, Any]]:
+        """Reorder results by maximal marginal relevance"""
+        try:
+            candidates = np.stack([
+                self.index.reconstruct(result["index"]) for result in results
+            ]).astype(np.float32)
+        except RuntimeError:
+            # Not all index types can reconstruct stored vectors
+            logger.warning("Index does not support reconstruction; skipping MMR")
+            return results
+
+        order = _mmr_order(query_array[0], candidates, np.float32(mmr_lambda))
+        return [results[i] for i in order]
+
+    def search_batch(self, query_embeddings: np.ndarray, k: int = 5) -> List[List[Dict[str, Any]]]:
+        """
+        Search for similar documents for a batch of queries in one FAISS call
+
+        Args:
+            query_embeddings: Array of query embeddings, shape (N, dimension)
+            k: Number of results to return per query
+
+        Returns:
+            One result list per query, in input order
+        """
+        # Copy so in-place normalization doesn't mutate the caller's array
+        query_array = np.array(query_embeddings, dtype=np.float32)
+        if query_array.size == 0:
+            return []
+        if query_array.ndim == 1:
+            query_array = query_array.reshape(1, -1)
+
+        # Normalize all queries row-wise
+        _normalize_rows(query_array)
+
+        with self._lock:
+            if self.index.ntotal == 0:
+                return [[] for _ in range(len(query_array))]
+
+            if hasattr(self.index, "hnsw"):
+                self.index.hnsw.efSearch = max(self.ef_search, 2 * k)
+            scores, indices = self.index.search(query_array, min(k, self.index.ntotal))
+
+            batch_results = []
+            for row_scores, row_indices in zip(scores, indices):
+                results = []
+                for score, idx in zip(row_scores, row_indices):
+                    if 0 <= idx < len(self.documents):
+                        results.append({
+                            "text": self.documents[idx],
+                            "metadata": self.metadata[idx],
+                            "score": float(score),
+                            "index": int(idx)
+                        })
+                batch_results.append(results)
+
+        logger.info(f"Batch search completed for {len(query_array)} queries")
+        return batch_results
+
+    def _check_query_cache(self, query_array: np.ndarray,
+                           k: int) -> Optional[List[Dict[str, Any]]]:
+        """Return cached results for a semantically near-identical query"""
+        if self.query_cache_index.ntotal == 0:
+            return None
+
+        scores, indices = self.query_cache_index.search(query_array, 1)
+        if scores[0][0] > self.query_cache_threshold:
+            cached = self.cached_results[indices[0][0]]
+            if len(cached) >= min(k, self.index.ntotal):
+                logger.info(f"Query cache hit (similarity {scores[0][0]:.3f})")
+                return cached[:k]
+        return None
+
+    def _update_query_cache(self, query_array: np.ndarray,
+                            results: List[Dict[str, Any]]):
+        """Store a query embedding and its results in the semantic cache"""
+        if len(self.cached_results) >= self.query_cache_size:
+            # Simple full-reset eviction; the cache refills from live traffic
+            self.query_cache_index.reset()
+            self.cached_results = []
+
+        self.query_cache_index.add(query_array)
+        self.cached_results.append(results)
+
+    def _clear_query_cache(self):
+        """Invalidate the semantic query cache"""
+        self.query_cache_index.reset()
+        self.cached_results = []
+
+    def flush(self):
+        """Persist pending changes to disk if there are any"""
+        with self._lock:
+            if not self._dirty:
+                return
+            self._save_index()
+            self._dirty = False
+            self._ops_since_flush = 0
+
     def _save_index(self):
         """Save the FAISS index and metadata to disk"""
         try:
-            # Save FAISS index
-            faiss.write_index(self.index, f"{self.index_path}.faiss")
-            
+            # Save FAISS index; GPU indexes must be copied back to the CPU
+            # before serialization
+            index_to_save = self.index
+            if self._on_gpu:
+                index_to_save = faiss.index_gpu_to_cpu(self.index)
+            faiss.write_index(index_to_save, f"{self.index_path}.faiss")
+
             # Save metadata
-            with open(f"{self.index_path}.pkl", 'wb') as f:
-                pickle.dump({
-                    'documents': self.documents,
-                    'metadata': self.metadata
-                }, f)
-            
+            if pa is not None:
+                # Columnar Arrow IPC file; loads back as a zero-copy mmap
+                table = pa.table({
+                    "document": self.documents,
+                    "metadata": [json.dumps(m) for m in self.metadata]
+                })
+                with pa.OSFile(f"{self.index_path}.arrow", 'wb') as sink:
+                    with pa.ipc.new_file(sink, table.schema) as writer:
+                        writer.write_table(table)
+            else:
+                with open(f"{self.index_path}.pkl", 'wb') as f:
+                    pickle.dump({
+                        'documents': self.documents,
+                        'metadata': self.metadata
+                    }, f)
+
             logger.info(f"Saved FAISS index and metadata to {self.index_path}")
-            
+
         except Exception as e:
             logger.error(f"Failed to save index: {e}")
             raise
     
     def get_stats(self) -> Dict[str, Any]:
         """Get statistics about the vector store"""
-        return {
-            "total_documents": len(self.documents),
-            "index_size": self.index.ntotal,
-            "embedding_dimension": self.dimension,
-            "index_path": self.index_path
-        }
-    
+        with self._lock:
+            return {
+                "total_documents": len(self.documents),
+                "index_size": self.index.ntotal,
+                "embedding_dimension": self.dimension,
+                "index_path": self.index_path
+            }
+
     def clear(self):
         """Clear all documents from the vector store"""
-        self._create_new_index()
-        self._save_index()
+        with self._lock:
+            self._create_new_index()
+            self._clear_query_cache()
+            self._save_index()
+            self._dirty = False
+            self._ops_since_flush = 0
         logger.info("Cleared all documents from vector store")
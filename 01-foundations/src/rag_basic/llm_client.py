@@ -1,7 +1,8 @@
 import openai
 import anthropic
+import httpx
 import os
-from typing import Optional, Dict, Any
+from typing import AsyncIterator, Optional, Dict, Any
 import logging
 
 logger = logging.getLogger(__name__)
@@ -25,50 +26,128 @@ class LLMClient:
         if not self.api_key:
             raise ValueError(f"API key required for {provider}")
         
-        # Initialize provider-specific client
+        # Initialize provider-specific async client; a sync client would
+        # block the event loop and serialize concurrent requests
         if self.provider == "openai":
-            self.client = openai.OpenAI(api_key=self.api_key)
+            self.client = openai.AsyncOpenAI(
+                api_key=self.api_key,
+                max_retries=2,
+                timeout=30,
+                http_client=httpx.AsyncClient(
+                    limits=httpx.Limits(max_connections=100,
+                                        max_keepalive_connections=20)
+                )
+            )
         elif self.provider == "anthropic":
-            self.client = anthropic.Anthropic(api_key=self.api_key)
+            self.client = anthropic.AsyncAnthropic(api_key=self.api_key)
         else:
             raise ValueError(f"Unsupported provider: {provider}")
         
         logger.info(f"Initialized {provider} client with model {model}")
     
-    async def generate(self, prompt: str, max_tokens: Optional[int] = None, 
-                      temperature: Optional[float] = None) -> str:
+    def _build_messages(self, prompt: str, system: Optional[str]) -> list:
+        """Build the OpenAI-style message list for a request"""
+        messages = []
+        if system:
+            # Static, byte-identical system prefix first so the provider's
+            # KV/prefix cache can reuse it across requests
+            messages.append({"role": "system", "content": system})
+        messages.append({"role": "user", "content": prompt})
+        return messages
+
+    def _build_anthropic_system(self, system: Optional[str]):
+        """Build the Anthropic system blocks with prefix caching enabled"""
+        if not system:
+            return anthropic.NOT_GIVEN
+        return [{"type": "text", "text": system,
+                 "cache_control": {"type": "ephemeral"}}]
+
+    async def generate(self, prompt: str, max_tokens: Optional[int] = None,
+                      temperature: Optional[float] = None,
+                      system: Optional[str] = None) -> str:
         """
         Generate text using the LLM
-        
+
         Args:
             prompt: Input prompt
             max_tokens: Maximum tokens to generate
             temperature: Sampling temperature
-            
+            system: Optional static system prompt, kept separate from the
+                per-request prompt so providers can cache its prefix
+
         Returns:
             Generated text
         """
         try:
             if self.provider == "openai":
-                return await self._generate_openai(prompt, max_tokens, temperature)
+                return await self._generate_openai(prompt, max_tokens, temperature, system)
             elif self.provider == "anthropic":
-                return await self._generate_anthropic(prompt, max_tokens, temperature)
+                return await self._generate_anthropic(prompt, max_tokens, temperature, system)
             else:
                 raise ValueError(f"Unsupported provider: {self.provider}")
-                
+
         except Exception as e:
             logger.error(f"Error generating text with {self.provider}: {e}")
             raise
     
-    async def _generate_openai(self, prompt: str, max_tokens: Optional[int] = None, 
-                              temperature: Optional[float] = None) -> str:
+    async def generate_stream(self, prompt: str, max_tokens: Optional[int] = None,
+                              temperature: Optional[float] = None,
+                              system: Optional[str] = None) -> AsyncIterator[str]:
+        """
+        Generate text using the LLM, yielding it chunk by chunk
+
+        Streaming means the first tokens are visible after roughly
+        first-token latency instead of full-generation latency.
+
+        Args:
+            prompt: Input prompt
+            max_tokens: Maximum tokens to generate
+            temperature: Sampling temperature
+            system: Optional static system prompt (cacheable prefix)
+
+        Yields:
+            Generated text chunks
+        """
+        try:
+            if self.provider == "openai":
+                stream = await self.client.chat.completions.create(
+                    model=self.model,
+                    messages=self._build_messages(prompt, system),
+                    max_tokens=max_tokens or int(os.getenv("MAX_TOKENS", "1000")),
+                    temperature=temperature or float(os.getenv("TEMPERATURE", "0.1")),
+                    stream=True
+                )
+                async for chunk in stream:
+                    delta = chunk.choices[0].delta.content
+                    if delta:
+                        yield delta
+            elif self.provider == "anthropic":
+                async with self.client.messages.stream(
+                    model=self.model,
+                    max_tokens=max_tokens or int(os.getenv("MAX_TOKENS", "1000")),
+                    temperature=temperature or float(os.getenv("TEMPERATURE", "0.1")),
+                    system=self._build_anthropic_system(system),
+                    messages=[
+                        {"role": "user", "content": prompt}
+                    ]
+                ) as stream:
+                    async for text in stream.text_stream:
+                        yield text
+            else:
+                raise ValueError(f"Unsupported provider: {self.provider}")
+
+        except Exception as e:
+            logger.error(f"Error streaming text with {self.provider}: {e}")
+            raise
+
+    async def _generate_openai(self, prompt: str, max_tokens: Optional[int] = None,
+                              temperature: Optional[float] = None,
+                              system: Optional[str] = None) -> str:
         """Generate text using OpenAI"""
         try:
-            response = self.client.chat.completions.create(
+            response = await self.client.chat.completions.create(
                 model=self.model,
-                messages=[
-                    {"role": "user", "content": prompt}
-                ],
+                messages=self._build_messages(prompt, system),
                 max_tokens=max_tokens or int(os.getenv("MAX_TOKENS", "1000")),
                 temperature=temperature or float(os.getenv("TEMPERATURE", "0.1"))
             )
@@ -79,14 +158,16 @@ class LLMClient:
             logger.error(f"OpenAI API error: {e}")
             raise
     
-    async def _generate_anthropic(self, prompt: str, max_tokens: Optional[int] = None, 
-                                 temperature: Optional[float] = None) -> str:
+    async def _generate_anthropic(self, prompt: str, max_tokens: Optional[int] = None,
+                                 temperature: Optional[float] = None,
+                                 system: Optional[str] = None) -> str:
         """Generate text using Anthropic"""
         try:
             response = await self.client.messages.create(
                 model=self.model,
                 max_tokens=max_tokens or int(os.getenv("MAX_TOKENS", "1000")),
                 temperature=temperature or float(os.getenv("TEMPERATURE", "0.1")),
+                system=self._build_anthropic_system(system),
                 messages=[
                     {"role": "user", "content": prompt}
                 ]
@@ -1,3 +1,5 @@
+import os
+
 import pytest
 import numpy as np
 from src.rag_basic.embedder import SentenceTransformerEmbedder
@@ -18,10 +20,21 @@ class TestRAGComponents:
         embedder = SentenceTransformerEmbedder()
         texts = ["Hello world", "This is a test"]
         embeddings = embedder.embed_texts(texts)
-        
-        assert len(embeddings) == 2
+
+        assert isinstance(embeddings, np.ndarray)
+        assert embeddings.dtype == np.float32
+        assert embeddings.shape[0] == 2
         assert all(isinstance(emb, np.ndarray) for emb in embeddings)
         assert all(len(emb) > 0 for emb in embeddings)
+
+    def test_embed_cache_returns_identical_embeddings(self):
+        """Test that repeated texts are served from the embed cache"""
+        embedder = SentenceTransformerEmbedder()
+        first = embedder.embed_texts(["Cached text"])
+        second = embedder.embed_texts(["Cached text"])
+
+        assert len(embedder._cache) == 1
+        np.testing.assert_array_equal(first, second)
     
     def test_vector_store_initialization(self):
         """Test that the vector store can be initialized"""
@@ -49,6 +62,50 @@ class TestRAGComponents:
         assert "score" in results[0]
         assert "metadata" in results[0]
     
+    def test_search_batch_ordering_and_format(self, tmp_path):
+        """Test that batch search returns per-query results in input order"""
+        store = FAISSVectorStore(index_path=str(tmp_path / "batch_index"), dimension=4)
+        documents = ["Doc A", "Doc B", "Doc C"]
+        embeddings = np.eye(3, 4, dtype=np.float32)
+        store.add_documents(documents, embeddings)
+
+        # Query with the vectors for Doc C and Doc A, in that order
+        queries = embeddings[[2, 0]]
+        results = store.search_batch(queries, k=2)
+
+        assert len(results) == 2
+        assert results[0][0]["text"] == "Doc C"
+        assert results[1][0]["text"] == "Doc A"
+        for per_query in results:
+            assert all({"text", "metadata", "score", "index"} <= set(r) for r in per_query)
+            scores = [r["score"] for r in per_query]
+            assert scores == sorted(scores, reverse=True)
+
+    def test_search_batch_empty_queries(self, tmp_path):
+        """Test that an empty query batch returns no results"""
+        store = FAISSVectorStore(index_path=str(tmp_path / "empty_index"), dimension=4)
+        store.add_documents(["Doc"], np.ones((1, 4), dtype=np.float32))
+
+        assert store.search_batch(np.empty((0, 0), dtype=np.float32)) == []
+
+    def test_flush_coalesces_writes(self, tmp_path):
+        """Test that adds are persisted by flush, not on every insert"""
+        index_path = str(tmp_path / "flush_index")
+        store = FAISSVectorStore(index_path=index_path, dimension=4)
+        store.add_documents(["Doc"], np.ones((1, 4), dtype=np.float32))
+
+        # Below FLUSH_EVERY nothing has been written yet
+        assert not os.path.exists(f"{index_path}.faiss")
+        assert store._dirty
+
+        store.flush()
+        assert os.path.exists(f"{index_path}.faiss")
+        assert not store._dirty
+
+        # A fresh store at the same path sees the persisted documents
+        reloaded = FAISSVectorStore(index_path=index_path, dimension=4)
+        assert reloaded.get_stats()["total_documents"] == 1
+
     def test_llm_client_initialization(self):
         """Test that LLM client can be initialized (without API key)"""
         # This test will fail if no API key is provided, which is expected